@@ -9,6 +9,7 @@ import logging
 DEBUG_MODE = bool(os.environ.get('DEBUG_MODE', ''))
 LISTEN_PORT = int(os.environ.get('LISTEN_PORT', 8000))
 UNIX_SOCKET = os.environ.get('UNIX_SOCKET', '')
+STATIC_PATH = os.path.join(os.path.dirname(__file__), '../public')
 
 if DEBUG_MODE:
     logging.basicConfig(level=logging.DEBUG)
@@ -19,14 +20,18 @@ from .handler.route import route
 
 from tornado.ioloop import IOLoop
 from tornado.web import Application
+from tornadotoolset.static import ManifestStaticFileHandler
 from datetime import datetime
 
 
 def make_app():
+    # Read `public/bundle/manifest.json` written by webpack.
+    ManifestStaticFileHandler.load_manifest(STATIC_PATH)
     return Application(
         handlers=route.get_routes(),
         template_path=os.path.join(os.path.dirname(__file__), 'template'),
-        static_path=os.path.join(os.path.dirname(__file__), '../public'),
+        static_path=STATIC_PATH,
+        static_handler_class=ManifestStaticFileHandler,
         debug=DEBUG_MODE,
         autoreload=False)
 
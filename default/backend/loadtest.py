@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+""" backend load test entry point
+    - python -m backend.loadtest scenario.json
+    - python -m backend.loadtest --help
+"""
+
+from tornadotoolset.loadtest import main
+
+if __name__ == '__main__':
+    # Do not import the app here, it connects to the database which must not
+    # be shared with the forked servers.
+    main('backend.app.make_app')
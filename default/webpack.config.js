@@ -1,12 +1,72 @@
 const path = require('path');
 const webpack = require('webpack');
+const zlib = require('zlib');
+
+// Written to public/bundle, read by ManifestStaticFileHandler at startup.
+const MANIFEST_NAME = 'manifest.json';
+const COMPRESS_TEST = /\.(js|css|html|svg|json)$/;
+const COMPRESS_MIN_SIZE = 1024;
+
+const addAsset = (compilation, name, buffer) => {
+  compilation.assets[name] = {
+    source: () => buffer,
+    size: () => buffer.length
+  };
+};
+
+// Map `bundle/<name>` to `bundle/<name>.<hash>`, and in production write
+// `.gz` and `.br` siblings so the server does not compress them per request.
+class StaticManifestPlugin {
+  constructor(outputDir, compress) {
+    this.outputDir = outputDir;
+    this.compress = compress;
+  }
+
+  apply(compiler) {
+    compiler.hooks.emit.tap('StaticManifestPlugin', compilation => {
+      const manifest = {};
+      Object.keys(compilation.assets).forEach(name => {
+        if (name.endsWith('.map')) {
+          return;
+        }
+        const logicalName = name.replace(/\.[0-9a-f]{8}(?=\.[^.]+$)/, '');
+        manifest[`${this.outputDir}/${logicalName}`] = `${
+          this.outputDir
+        }/${name}`;
+
+        if (!this.compress) {
+          return;
+        }
+        const source = compilation.assets[name].source();
+        const buffer = Buffer.isBuffer(source) ? source : Buffer.from(source);
+        if (!COMPRESS_TEST.test(name) || buffer.length < COMPRESS_MIN_SIZE) {
+          return;
+        }
+        addAsset(
+          compilation,
+          `${name}.gz`,
+          zlib.gzipSync(buffer, { level: 9 })
+        );
+        if (zlib.brotliCompressSync) {
+          addAsset(compilation, `${name}.br`, zlib.brotliCompressSync(buffer));
+        }
+      });
+      addAsset(
+        compilation,
+        MANIFEST_NAME,
+        Buffer.from(JSON.stringify(manifest, null, 2))
+      );
+    });
+  }
+}
 
 const generateConfig = (
   entry,
   outputName,
   includeFrom,
   resolveAlias,
-  envNames
+  envNames,
+  isProduction
 ) => ({
   node: {
     __dirname: true
@@ -18,7 +78,9 @@ const generateConfig = (
   entry: [entry],
   output: {
     path: path.resolve(__dirname, 'public/bundle'),
-    filename: outputName
+    filename: isProduction
+      ? outputName.replace(/(\.[^.]+)$/, '.[contenthash:8]$1')
+      : outputName
   },
   resolve: {
     extensions: ['.js', '.jsx'],
@@ -29,7 +91,10 @@ const generateConfig = (
     }, {})
   },
   devtool: 'source-map',
-  plugins: [new webpack.EnvironmentPlugin(envNames)],
+  plugins: [
+    new webpack.EnvironmentPlugin(envNames),
+    new StaticManifestPlugin('bundle', isProduction)
+  ],
   module: {
     rules: [
       {
@@ -47,7 +112,7 @@ const generateConfig = (
   }
 });
 
-module.exports = [
+module.exports = (env, argv) => [
   generateConfig(
     './frontend/main.jsx',
     'index.js',
@@ -58,6 +123,7 @@ module.exports = [
       store: 'frontend/store/',
       utils: 'frontend/utils/'
     },
-    ['PAGE_TITLE']
+    ['PAGE_TITLE'],
+    argv.mode === 'production'
   )
 ];
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+""" Tornado handler mixins to stream files from and to GridFS
+Example:
+
+@stream_request_body
+class AvatarHandler(GridFSUploadMixin, GridFSDownloadMixin, RequestHandler):
+    UPLOAD_BUCKET = (User, 'avatar')
+
+    async def get(self, uid):
+        user = User.find_one({'uid': uid})
+        await self.send_grid_file(user.open_file('avatar'))
+
+    async def post(self, uid):
+        uploads = await self.finish_upload()
+        user = User.find_one({'uid': uid})
+        user['avatar'] = uploads['avatar'][0].file_id
+        user.save()
+
+The request body is written to GridFS chunk by chunk while it arrives, so the
+memory used by an upload is bounded by the GridFS chunk size. Both
+multipart/form-data and raw bodies (the file name in the `filename` query
+argument) are accepted.
+
+pymongo is blocking, so the GridFS chunks are written and read from the
+default executor of the IOLoop. Other database calls of the handler, like
+`find_one` or `open_file` above, still block the IOLoop.
+"""
+
+from tornado import httputil
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.web import HTTPError
+from urllib.parse import quote
+
+import collections
+import logging
+
+UploadedFile = collections.namedtuple(
+    'UploadedFile', ['file_id', 'filename', 'content_type', 'length'])
+
+
+def get_multipart_boundary(content_type):
+    for field in content_type.split(';'):
+        key, _, val = field.strip().partition('=')
+        if key == 'boundary' and val:
+            if val.startswith('"') and val.endswith('"'):
+                val = val[1:-1]
+            return val.encode('latin1')
+    return None
+
+
+class MultipartStreamParser():
+    """ Incremental multipart/form-data parser.
+
+    `open_file(name, filename, content_type)` returns a writer (with `write`
+    and `close`) for every file part. Other parts are passed to
+    `on_field(name, value)` once complete.
+    """
+    MAX_HEADER_SIZE = 16 * 1024
+
+    _PREAMBLE = 0
+    _HEADERS = 1
+    _BODY = 2
+    _END = 3
+
+    def __init__(self, boundary, open_file, on_field, field_size_limit):
+        self._delimiter = b'\r\n--' + boundary
+        self._open_file = open_file
+        self._on_field = on_field
+        self._field_size_limit = field_size_limit
+        # The first delimiter is not preceded by a CRLF, add one so every
+        # delimiter looks the same.
+        self._buffer = bytearray(b'\r\n')
+        self._state = self._PREAMBLE
+        self._part_name = None
+        self._part_writer = None
+        self._part_value = None
+
+    def is_finished(self):
+        return self._state == self._END
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        while self._state != self._END:
+            if self._state == self._PREAMBLE:
+                progress = self._parse_preamble()
+            elif self._state == self._HEADERS:
+                progress = self._parse_headers()
+            else:
+                progress = self._parse_body()
+            if not progress:
+                return
+
+    def _parse_preamble(self):
+        index = self._buffer.find(self._delimiter)
+        if index < 0:
+            # Keep what may be the start of the delimiter.
+            del self._buffer[:-len(self._delimiter)]
+            return False
+        return self._parse_delimiter_end(index)
+
+    def _parse_delimiter_end(self, index):
+        end = index + len(self._delimiter)
+        if len(self._buffer) < end + 2:
+            return False
+        suffix = bytes(self._buffer[end:end + 2])
+        del self._buffer[:end + 2]
+        if suffix == b'--':
+            self._state = self._END
+            self._buffer.clear()
+        elif suffix == b'\r\n':
+            self._state = self._HEADERS
+        else:
+            raise ValueError('Invalid multipart delimiter.')
+        return True
+
+    def _parse_headers(self):
+        index = self._buffer.find(b'\r\n\r\n')
+        if index < 0:
+            if len(self._buffer) > self.MAX_HEADER_SIZE:
+                raise ValueError('Multipart headers too large.')
+            return False
+        try:
+            headers = httputil.HTTPHeaders.parse(
+                self._buffer[:index].decode('utf-8'))
+        except httputil.HTTPInputError as e:
+            raise ValueError('Invalid multipart headers: %s' % e)
+        del self._buffer[:index + 4]
+
+        disposition, params = httputil._parse_header(
+            headers.get('Content-Disposition', ''))
+        if disposition != 'form-data' or not params.get('name'):
+            raise ValueError('Invalid multipart Content-Disposition.')
+        self._part_name = params['name']
+        if 'filename' in params:
+            self._part_writer = self._open_file(
+                self._part_name, params['filename'],
+                headers.get('Content-Type', 'application/octet-stream'))
+        else:
+            self._part_value = bytearray()
+        self._state = self._BODY
+        return True
+
+    def _write_part(self, data):
+        if not data:
+            return
+        if self._part_writer is not None:
+            self._part_writer.write(bytes(data))
+            return
+        self._part_value.extend(data)
+        if len(self._part_value) > self._field_size_limit:
+            raise ValueError('Multipart field %s too large.' % self._part_name)
+
+    def _parse_body(self):
+        index = self._buffer.find(self._delimiter)
+        if index < 0:
+            keep = len(self._delimiter) - 1
+            if len(self._buffer) > keep:
+                self._write_part(self._buffer[:-keep])
+                del self._buffer[:-keep]
+            return False
+
+        self._write_part(self._buffer[:index])
+        del self._buffer[:index]
+        if len(self._buffer) < len(self._delimiter) + 2:
+            return False
+        if self._part_writer is not None:
+            self._part_writer.close()
+        else:
+            self._on_field(self._part_name, bytes(self._part_value))
+        self._part_name = self._part_writer = self._part_value = None
+        return self._parse_delimiter_end(0)
+
+
+class GridFSUploadMixin():
+    """ Write the request body to GridFS while it is received.
+
+    The handler must be decorated with `tornado.web.stream_request_body` and
+    set `UPLOAD_BUCKET` (or override `get_upload_bucket`). A `prepare` of the
+    handler must call `super().prepare()`.
+    """
+    # (Collection class, FileField name) to store the uploaded files.
+    UPLOAD_BUCKET = None
+    # None to keep the `max_body_size` of the HTTPServer.
+    MAX_UPLOAD_SIZE = None
+    UPLOAD_FIELD_SIZE_LIMIT = 64 * 1024
+    RAW_UPLOAD_FIELD_NAME = 'file'
+
+    def get_upload_bucket(self, name):
+        """ Return the GridFSBucket to store the file of form field `name`.
+        """
+        if not self.UPLOAD_BUCKET:
+            raise RuntimeError(
+                'UPLOAD_BUCKET of %s is not set.' % self.__class__.__name__)
+        collection, key = self.UPLOAD_BUCKET
+        return collection.get_file_bucket(key)
+
+    def prepare(self):
+        super().prepare()
+        self._upload_files = collections.defaultdict(list)
+        self._upload_writers = []
+        self._upload_parser = None
+        self._upload_error = None
+        self._upload_pending = None
+        self._upload_aborted = False
+        if self.request.method not in ('POST', 'PUT', 'PATCH'):
+            return
+        if self.MAX_UPLOAD_SIZE:
+            self.request.connection.set_max_body_size(self.MAX_UPLOAD_SIZE)
+
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            boundary = get_multipart_boundary(content_type)
+            if not boundary:
+                raise HTTPError(400, 'Missing multipart boundary.')
+            self._upload_parser = MultipartStreamParser(
+                boundary, self._open_upload_stream, self._add_upload_argument,
+                self.UPLOAD_FIELD_SIZE_LIMIT)
+        else:
+            # Opening the stream does not touch the database.
+            self._open_upload_stream(
+                self.RAW_UPLOAD_FIELD_NAME,
+                self.get_query_argument('filename', 'upload'), content_type or
+                'application/octet-stream')
+
+    def _open_upload_stream(self, name, filename, content_type):
+        if self._upload_aborted:
+            raise ValueError('Upload aborted.')
+        grid_in = self.get_upload_bucket(name).open_upload_stream(
+            filename, metadata={'contentType': content_type})
+        self._upload_writers.append((name, grid_in))
+        return grid_in
+
+    def _add_upload_argument(self, name, value):
+        self.request.body_arguments.setdefault(name, []).append(value)
+        self.request.arguments.setdefault(name, []).append(value)
+
+    def _write_upload(self, chunk):
+        if self._upload_aborted:
+            return
+        if self._upload_parser:
+            self._upload_parser.feed(chunk)
+        elif self._upload_writers:
+            self._upload_writers[-1][1].write(chunk)
+
+    async def data_received(self, chunk):
+        if self._upload_error or self._upload_aborted:
+            return
+        # pymongo blocks, so GridFS is written from the executor. The next
+        # chunk is not read until this one is written.
+        self._upload_pending = IOLoop.current().run_in_executor(
+            None, self._write_upload, chunk)
+        try:
+            await self._upload_pending
+        except ValueError as e:
+            # Raising here would close the connection without a response,
+            # report it in finish_upload() instead.
+            self._upload_error = str(e)
+            self._abort_upload()
+
+    @staticmethod
+    def _close_upload_writers(writers):
+        uploads = []
+        for name, grid_in in writers:
+            if not grid_in.closed:
+                grid_in.close()
+            uploads.append((name,
+                            UploadedFile(grid_in._id, grid_in.filename,
+                                         grid_in.metadata['contentType'],
+                                         grid_in.length)))
+        return uploads
+
+    async def finish_upload(self):
+        """ Return a dict of form field name to a list of UploadedFile.
+        """
+        if self._upload_error:
+            raise HTTPError(400, self._upload_error)
+        if self._upload_parser and not self._upload_parser.is_finished():
+            raise HTTPError(400, 'Incomplete multipart body.')
+        writers, self._upload_writers = self._upload_writers, []
+        uploads = await IOLoop.current().run_in_executor(
+            None, self._close_upload_writers, writers)
+        for name, upload in uploads:
+            self._upload_files[name].append(upload)
+        return dict(self._upload_files)
+
+    @staticmethod
+    def _abort_upload_writers(writers):
+        for _, grid_in in writers:
+            try:
+                grid_in.abort()
+            except Exception:
+                logging.exception('Abort GridFS upload failed.')
+
+    async def _abort_upload_later(self, pending):
+        if pending is not None:
+            try:
+                # Do not abort a GridIn while a chunk is written to it.
+                await pending
+            except Exception:
+                pass
+        # Take the writers after the pending write, it may have opened a file.
+        writers, self._upload_writers = self._upload_writers, []
+        if writers:
+            await IOLoop.current().run_in_executor(
+                None, self._abort_upload_writers, writers)
+
+    def _abort_upload(self):
+        if not hasattr(self, '_upload_writers'):
+            return
+        self._upload_aborted = True
+        pending = self._upload_pending
+        if pending is not None and pending.done():
+            pending = None
+        if self._upload_writers or pending is not None:
+            IOLoop.current().spawn_callback(self._abort_upload_later, pending)
+
+    def on_connection_close(self):
+        self._abort_upload()
+        super().on_connection_close()
+
+    def on_finish(self):
+        # Uploads not taken by finish_upload() are removed.
+        self._abort_upload()
+        super().on_finish()
+
+
+class GridFSDownloadMixin():
+    """ Stream a GridOut to the client, with Range request support.
+
+    The chunks are read from the executor.
+    """
+
+    async def send_grid_file(self,
+                             grid_out,
+                             include_body=True,
+                             as_attachment=False):
+        if grid_out is None:
+            raise HTTPError(404)
+        try:
+            await self._send_grid_file(grid_out, include_body, as_attachment)
+        finally:
+            # Close the chunks cursor when the client left before the end.
+            await IOLoop.current().run_in_executor(None, grid_out.close)
+
+    async def _send_grid_file(self, grid_out, include_body, as_attachment):
+        metadata = grid_out.metadata or {}
+        self.set_header('Accept-Ranges', 'bytes')
+        self.set_header('Etag', '"%s"' % grid_out._id)
+        self.set_header('Last-Modified', grid_out.upload_date)
+        self.set_header('Content-Type',
+                        metadata.get('contentType', 'application/octet-stream'))
+        if as_attachment:
+            self.set_header(
+                'Content-Disposition',
+                "attachment; filename*=UTF-8''%s" % quote(grid_out.filename))
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        size = grid_out.length
+        start, end = 0, size
+        request_range = None
+        range_header = self.request.headers.get('Range')
+        if range_header:
+            request_range = httputil._parse_request_range(range_header)
+        if request_range:
+            range_start, range_end = request_range
+            if range_start is not None and range_start < 0:
+                range_start = max(range_start + size, 0)
+            if ((range_start is not None and
+                 (range_start >= size or
+                  (range_end is not None and range_start >= range_end))) or
+                    range_end == 0):
+                self.set_status(416)
+                self.set_header('Content-Type', 'text/plain')
+                self.set_header('Content-Range', 'bytes */%d' % size)
+                return
+            start = range_start or 0
+            end = size if range_end is None else min(range_end, size)
+            if end - start != size:
+                self.set_status(206)
+                self.set_header('Content-Range',
+                                httputil._get_content_range(start, end, size))
+        self.set_header('Content-Length', end - start)
+        if not include_body:
+            return
+
+        grid_out.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = await IOLoop.current().run_in_executor(
+                None, grid_out.read, min(grid_out.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            try:
+                self.write(chunk)
+                await self.flush()
+            except StreamClosedError:
+                return
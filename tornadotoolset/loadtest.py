@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+""" HTTP load generator for tornado application
+Example:
+
+scenario.json:
+{
+    "requests": [
+        {"method": "GET", "path": "/"},
+        {"method": "GET", "path": "/user", "params": {"page": 2}},
+        {"method": "POST", "path": "/login", "data": {"user": "bob"}},
+        {"method": "POST", "path": "/api/item", "json": {"name": "foo"}}
+    ]
+}
+
+backend/loadtest.py:
+
+from tornadotoolset.loadtest import main
+
+main('backend.app.make_app')
+
+python -m backend.loadtest scenario.json --concurrency 50 --duration 10
+python -m backend.loadtest scenario.json --rate 200 --processes 4
+
+The app is started in forked processes which share the listening socket, and
+the requests of the scenario are replayed in order until the duration (or the
+number of requests) is reached. The report is printed as json.
+
+`make_app` is given as a dotted path and imported in the forked servers only.
+Importing the app module in the load test process would open its database
+clients (e.g. `tornadotoolset.pymonorm` connects when it is imported) before
+the fork, and a MongoClient must not be used across a fork.
+
+The requests are sent by CurlAsyncHTTPClient, which keeps the connections
+alive, when pycurl is installed. Otherwise SimpleAsyncHTTPClient opens a new
+connection for every request, so the latency includes the connect, and the
+single load test process is often the bottleneck with several servers. The
+client used is written in the `config` of the report.
+"""
+
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+from tornado.netutil import Resolver, bind_sockets
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.util import import_object
+from urllib.parse import urlencode
+
+import argparse
+import collections
+import json
+import logging
+import math
+import os
+import signal
+import socket
+import sys
+import time
+
+try:
+    # pycurl is optional.
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+REPORT_PERCENTILES = [50, 95, 99]
+HTTP_CLIENTS = ['auto', 'curl', 'simple']
+
+
+def load_scenario(path):
+    with open(path, 'r') as scenario_file:
+        scenario = json.load(scenario_file)
+    entries = scenario.get('requests', []) if isinstance(scenario,
+                                                         dict) else scenario
+    if not entries:
+        raise ValueError('Scenario %s has no request.' % path)
+    for entry in entries:
+        if 'path' not in entry:
+            raise ValueError('Missing path in scenario request: %r' % entry)
+    return entries
+
+
+def build_request(base_url, entry, timeout):
+    method = entry.get('method', 'GET').upper()
+    url = base_url + entry['path']
+    if entry.get('params'):
+        url += '?' + urlencode(entry['params'], doseq=True)
+
+    headers = dict(entry.get('headers', {}))
+    body = None
+    if 'json' in entry:
+        body = json.dumps(entry['json'])
+        headers.setdefault('Content-Type', 'application/json')
+    elif 'data' in entry:
+        body = urlencode(entry['data'], doseq=True)
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+    elif 'body' in entry:
+        body = entry['body']
+    if body is None and method in ('POST', 'PUT', 'PATCH'):
+        body = ''
+
+    return HTTPRequest(
+        url=url,
+        method=method,
+        headers=headers,
+        body=body,
+        request_timeout=timeout,
+        follow_redirects=False,
+        allow_nonstandard_methods=True,
+        validate_cert=False)
+
+
+def get_entry_name(entry):
+    return entry.get('name', '%s %s' % (entry.get('method', 'GET').upper(),
+                                        entry['path']))
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize_latencies(latencies):
+    values = sorted(latencies)
+    summary = {
+        'p%d' % pct: _to_ms(percentile(values, pct))
+        for pct in REPORT_PERCENTILES
+    }
+    summary['max'] = _to_ms(values[-1] if values else None)
+    summary['mean'] = _to_ms(sum(values) / len(values) if values else None)
+    return summary
+
+
+def _to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class LoadReport():
+
+    def __init__(self):
+        self._latencies = collections.defaultdict(list)
+        self._errors = collections.Counter()
+        self._status = collections.Counter()
+
+    def record(self, name, latency, code):
+        self._latencies[name].append(latency)
+        self._status[str(code)] += 1
+        if code >= 400:
+            self._errors[name] += 1
+
+    def to_dict(self, elapsed):
+        all_latencies = []
+        routes = {}
+        for name, latencies in self._latencies.items():
+            all_latencies.extend(latencies)
+            routes[name] = {
+                'requests': len(latencies),
+                'errors': self._errors[name],
+                'error_rate': self._errors[name] / len(latencies),
+                'latency_ms': summarize_latencies(latencies),
+            }
+
+        count = len(all_latencies)
+        errors = sum(self._errors.values())
+        return {
+            'requests': count,
+            'duration': round(elapsed, 3),
+            'throughput': count / elapsed if elapsed > 0 else 0,
+            'errors': errors,
+            'error_rate': errors / count if count else 0,
+            'status': dict(self._status),
+            'latency_ms': summarize_latencies(all_latencies),
+            'routes': routes,
+        }
+
+
+class UnixResolver(Resolver):
+    """ Resolve every host to a unix socket.
+    """
+
+    def initialize(self, socket_path):
+        self._socket_path = socket_path
+
+    async def resolve(self, host, port, family=socket.AF_UNSPEC):
+        return [(socket.AF_UNIX, self._socket_path)]
+
+
+class LoadGenerator():
+    """ Replay the scenario until `duration` seconds or `total` requests.
+
+    With `rate` the requests are sent at a fixed rate (at most `concurrency`
+    in flight), otherwise `concurrency` workers send them back to back.
+    `client` is one of HTTP_CLIENTS, 'auto' uses curl when it is installed
+    and no `resolver` is given.
+    """
+
+    def __init__(self,
+                 base_url,
+                 entries,
+                 concurrency=10,
+                 rate=0,
+                 duration=10,
+                 total=0,
+                 timeout=20,
+                 resolver=None,
+                 client='auto'):
+        self._entries = [(get_entry_name(entry),
+                          build_request(base_url, entry, timeout))
+                         for entry in entries]
+        self._concurrency = concurrency
+        self._rate = rate
+        self._duration = duration
+        self._total = total
+        if client == 'auto':
+            client = ('curl' if CurlAsyncHTTPClient and resolver is None else
+                      'simple')
+        if client == 'curl':
+            if not CurlAsyncHTTPClient:
+                raise RuntimeError('pycurl is not installed.')
+            if resolver is not None:
+                raise RuntimeError('The curl client does not take a resolver.')
+            self._client = CurlAsyncHTTPClient(
+                force_instance=True, max_clients=concurrency)
+        else:
+            self._client = SimpleAsyncHTTPClient(
+                force_instance=True, max_clients=concurrency, resolver=resolver)
+        self.client_name = client
+        self._report = LoadReport()
+        self._sent = 0
+        self._deadline = None
+
+    def _next_entry(self):
+        if self._total and self._sent >= self._total:
+            return None
+        if self._duration and time.monotonic() >= self._deadline:
+            return None
+        entry = self._entries[self._sent % len(self._entries)]
+        self._sent += 1
+        return entry
+
+    async def _do_request(self, name, request, start):
+        # Connection errors and timeouts are returned with code 599.
+        res = await self._client.fetch(request, raise_error=False)
+        self._report.record(name, time.monotonic() - start, res.code)
+
+    async def _run_worker(self):
+        while True:
+            entry = self._next_entry()
+            if entry is None:
+                return
+            await self._do_request(*entry, time.monotonic())
+
+    async def _run_with_rate(self):
+        slots = Semaphore(self._concurrency)
+        in_flight = set()
+
+        async def send(entry, scheduled):
+            try:
+                await self._do_request(*entry, scheduled)
+            finally:
+                slots.release()
+
+        start = time.monotonic()
+        while True:
+            entry = self._next_entry()
+            if entry is None:
+                break
+            # Latency is counted from the scheduled time, so a slow server
+            # can not hide its queueing delay by slowing the sender down.
+            scheduled = start + (self._sent - 1) / self._rate
+            await gen.sleep(max(0, scheduled - time.monotonic()))
+            await slots.acquire()
+            future = gen.convert_yielded(send(entry, scheduled))
+            in_flight.add(future)
+            future.add_done_callback(in_flight.discard)
+        await gen.multi(list(in_flight))
+
+    async def run(self):
+        start = time.monotonic()
+        self._deadline = start + self._duration
+        if self._rate:
+            await self._run_with_rate()
+        else:
+            await gen.multi(
+                [self._run_worker() for _ in range(self._concurrency)])
+        elapsed = time.monotonic() - start
+        self._client.close()
+        return self._report.to_dict(elapsed)
+
+
+def start_servers(make_app, processes=1, port=0, unix_socket=''):
+    """ Fork `processes` servers sharing one listening socket.
+
+    `make_app` is the dotted path of the app factory, it is imported after
+    the fork so no database client of the app exists in this process. A
+    callable is also accepted if importing it opens nothing. Must be called
+    before any IOLoop is created in this process. Return the pids of the
+    servers and the base url to reach them.
+    """
+    if unix_socket:
+        # Windows does not support bind_unix_socket
+        from tornado.netutil import bind_unix_socket
+        sockets = [bind_unix_socket(unix_socket, mode=0o666)]
+        base_url = 'http://localhost'
+    else:
+        sockets = bind_sockets(port, address='127.0.0.1')
+        base_url = 'http://127.0.0.1:%d' % sockets[0].getsockname()[1]
+
+    pids = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                # Writing a log line per request would skew the result.
+                logging.getLogger('tornado.access').setLevel(logging.ERROR)
+                if isinstance(make_app, str):
+                    make_app = import_object(make_app)
+                server = HTTPServer(make_app(), xheaders=True)
+                server.add_sockets(sockets)
+                IOLoop.current().start()
+            except BaseException:
+                logging.exception('Loadtest: Server process failed.')
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        pids.append(pid)
+
+    # Connections are queued by the kernel until a server accepts them, so
+    # the servers do not need to be ready when the load starts.
+    for sock in sockets:
+        sock.close()
+    return pids, base_url
+
+
+def stop_servers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+
+
+def main(make_app=None):
+    parser = argparse.ArgumentParser(description='Run the load test.')
+    parser.add_argument('scenario', help='The scenario json file.')
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        action='store',
+        default=10,
+        dest='concurrency',
+        help='The max number of requests in flight.',
+        type=int)
+    parser.add_argument(
+        '-r',
+        '--rate',
+        action='store',
+        default=0,
+        dest='rate',
+        help='Requests per second, 0 to send as fast as possible.',
+        type=float)
+    parser.add_argument(
+        '-d',
+        '--duration',
+        action='store',
+        default=10,
+        dest='duration',
+        help='Seconds to run, 0 to only stop at --requests.',
+        type=float)
+    parser.add_argument(
+        '-n',
+        '--requests',
+        action='store',
+        default=0,
+        dest='total',
+        help='The number of requests to send, 0 for no limit.',
+        type=int)
+    parser.add_argument(
+        '-p',
+        '--processes',
+        action='store',
+        default=1,
+        dest='processes',
+        help='The number of server processes.',
+        type=int)
+    parser.add_argument(
+        '--port',
+        action='store',
+        default=0,
+        dest='port',
+        help='The port to listen, 0 for a random port.',
+        type=int)
+    parser.add_argument(
+        '--unix-socket',
+        action='store',
+        default='',
+        dest='unix_socket',
+        help='Listen on this unix socket instead of a port.')
+    parser.add_argument(
+        '--url',
+        action='store',
+        default='',
+        dest='url',
+        help='Test a running server instead of starting the app.')
+    parser.add_argument(
+        '--timeout',
+        action='store',
+        default=20,
+        dest='timeout',
+        help='The timeout of each request, in seconds.',
+        type=float)
+    parser.add_argument(
+        '--client',
+        action='store',
+        choices=HTTP_CLIENTS,
+        default='auto',
+        dest='client',
+        help='The http client, curl keeps the connections alive.')
+    parser.add_argument(
+        '-o',
+        '--output',
+        action='store',
+        default='',
+        dest='output',
+        help='Write the report to this file instead of stdout.')
+    args = parser.parse_args()
+
+    if not args.duration and not args.total:
+        parser.error('One of --duration and --requests is required.')
+    if not args.url and not make_app:
+        parser.error('--url is required when no app is given.')
+    if args.client == 'curl':
+        if not CurlAsyncHTTPClient:
+            parser.error('--client curl requires pycurl.')
+        if args.unix_socket and not args.url:
+            parser.error('--client curl does not support --unix-socket.')
+
+    entries = load_scenario(args.scenario)
+    pids = []
+    resolver = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        pids, base_url = start_servers(make_app, args.processes, args.port,
+                                       args.unix_socket)
+        if args.unix_socket:
+            resolver = UnixResolver(socket_path=args.unix_socket)
+
+    try:
+        generator = LoadGenerator(
+            base_url,
+            entries,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            duration=args.duration,
+            total=args.total,
+            timeout=args.timeout,
+            resolver=resolver,
+            client=args.client)
+        report = IOLoop.current().run_sync(generator.run)
+    finally:
+        stop_servers(pids)
+        if pids and args.unix_socket and os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+
+    report['config'] = {
+        'scenario': args.scenario,
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'processes': 0 if args.url else args.processes,
+        'target': args.url or args.unix_socket or base_url,
+        'client': generator.client_name,
+        'keep_alive': generator.client_name == 'curl',
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
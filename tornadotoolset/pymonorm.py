@@ -16,9 +16,39 @@ user.save() # Save to mongodbs
 
 user = User.find_one('Bob')
 user.delete() # Delete bob
+
+Files are stored in GridFS, the document only keep the file id:
+
+User(Collection):
+    avatar = FileField(bucket_name='avatar')
+
+user.put_file('avatar', open('bob.png', 'rb'), 'bob.png', 'image/png')
+user.save() # The replaced avatar is removed from GridFS
+user.open_file('avatar').read()
+
+On a sharded cluster, declare the shard key so the operations on a document
+are routed to a single shard:
+
+User(Collection):
+    _ORM_collection_name = 'user'
+    _ORM_shard_key = ['uid']
+
+User.shard_collection() # Run once against mongos
+user = User.from_id(user_id, uid=uid)
+user['uid'] = 2 # RuntimeError, shard key can not be changed
+User.find_one({'name': 'Bob'}) # Logs a warning, the query is broadcast
+
+The check of the queries is a heuristic: a read is targeted when it has an
+equality (or `$in`) condition on a prefix of the shard key, a write on a single
+document (`save`, `delete`, `update` and `upsert`) needs an equality on the
+full shard key. Use `User.get_query_shards(query)` to know the shards a query
+is really sent to.
 """
 
 from bson.objectid import ObjectId
+from collections.abc import Mapping
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
 from pymongo import MongoClient
 
 import logging
@@ -31,6 +61,9 @@ DB_PWD = os.environ.get('DB_PWD', '')
 DB_NAME = os.environ.get('DB_NAME', 'TestDB')
 # The time out of MongoClient, in milliseconds.
 DB_TIMEOUT = 2000
+# What to do with queries which do not target a shard of a sharded collection:
+# 'warn' to log a warning, 'raise' to raise RuntimeError, '' to ignore.
+DB_SHARD_QUERY_CHECK = os.environ.get('DB_SHARD_QUERY_CHECK', 'warn')
 
 
 def get_database_from_env():
@@ -75,11 +108,31 @@ class Field():
             mongo_collection.create_index(field_name, unique=True)
 
 
+class FileField(Field):
+    """ A file stored in GridFS, the value of the field is the file id.
+    """
+
+    def __init__(self, bucket_name='fs', chunk_size=None):
+        super().__init__(default=None)
+        self._bucket_name = bucket_name
+        self._chunk_size = chunk_size
+
+    def get_bucket(self, database):
+        if self._chunk_size:
+            return GridFSBucket(
+                database,
+                bucket_name=self._bucket_name,
+                chunk_size_bytes=self._chunk_size)
+        return GridFSBucket(database, bucket_name=self._bucket_name)
+
+
 class Collection():
     _ORM_database_instance = get_database_from_env()
 
     # Note: Overwrite this var to spesify the collection name.
     _ORM_collection_name = 'default'
+    # Note: Overwrite this var with the field names of the shard key.
+    _ORM_shard_key = []
 
     @classmethod
     def _get_field_names(cls):
@@ -96,6 +149,13 @@ class Collection():
                         cls._ORM_field_names.append(attr)
         return cls._ORM_field_names
 
+    @classmethod
+    def _get_file_field_names(cls):
+        return [
+            attr for attr in cls._get_field_names()
+            if isinstance(getattr(cls, attr), FileField)
+        ]
+
     @classmethod
     def _check_instance(cls, val):
         if not isinstance(val, cls):
@@ -106,25 +166,159 @@ class Collection():
     def get_collection(cls):
         return cls._ORM_database_instance[cls._ORM_collection_name]
 
+    @classmethod
+    def shard_collection(cls):
+        """ Shard the collection on `_ORM_shard_key`, must connect to mongos.
+        """
+        database = cls._ORM_database_instance
+        database.client.admin.command('enableSharding', database.name)
+        database.client.admin.command(
+            'shardCollection',
+            cls.get_collection().full_name,
+            key={key: 1
+                 for key in cls._ORM_shard_key})
+
+    @staticmethod
+    def _is_equality_condition(condition, operators=('$eq', '$in')):
+        if not isinstance(condition, Mapping):
+            return True
+        # An embedded document without operator is matched as a value.
+        return all(op in operators or not op.startswith('$')
+                   for op in condition)
+
+    @classmethod
+    def check_shard_query(cls, query, full_key=False):
+        """ Return False if `query` may be broadcast to all shards.
+
+        It only looks for an equality or `$in` condition on the first field
+        of `_ORM_shard_key`, or an equality on every field with `full_key`
+        as required by the writes on a single document. See
+        `get_query_shards` for the real routing.
+        """
+        if not cls._ORM_shard_key:
+            return True
+        if query is None:
+            query = {}
+        elif not isinstance(query, Mapping):
+            # find_one(object_id) is a query on _id.
+            query = {'_id': query}
+        if full_key:
+            missing = [
+                key for key in cls._ORM_shard_key
+                if key not in query or
+                not cls._is_equality_condition(query[key], ('$eq',))
+            ]
+        else:
+            shard_key = cls._ORM_shard_key[0]
+            missing = [shard_key]
+            if (shard_key in query and
+                    cls._is_equality_condition(query[shard_key])):
+                missing = []
+        if not missing:
+            return True
+
+        message = ('DB: Query on %s without equality on shard key %s is '
+                   'broadcast: %r' % (cls._ORM_collection_name,
+                                      ','.join(missing), query))
+        if DB_SHARD_QUERY_CHECK == 'raise':
+            raise RuntimeError(message)
+        if DB_SHARD_QUERY_CHECK:
+            logging.warning(message)
+        return False
+
+    @classmethod
+    def get_query_shards(cls, query):
+        """ Return the names of the shards which `query` is sent to.
+
+        It is based on the explain of mongos, so it is empty if the
+        collection is not sharded.
+        """
+        explain = cls.get_collection().find(query).explain()
+        winning_plan = explain['queryPlanner']['winningPlan']
+        return [shard['shardName'] for shard in winning_plan.get('shards', [])]
+
+    @classmethod
+    def _get_query_arg(cls, args, kargs):
+        return args[0] if args else kargs.get('filter', None)
+
+    @classmethod
+    def _get_projection_arg(cls, args, kargs):
+        return args[1] if len(args) > 1 else kargs.get('projection', None)
+
+    @classmethod
+    def _add_shard_key(cls, orm_object, query, with_default=False):
+        query = dict(query)
+        for key in cls._ORM_shard_key:
+            if key not in query and (with_default or
+                                     key not in orm_object._default_field):
+                query[key] = orm_object._get_shard_value(key)
+        return query
+
+    @classmethod
+    def get_file_bucket(cls, key):
+        if key not in cls._get_file_field_names():
+            raise KeyError('%s is not a FileField of %s.' % (key,
+                                                              cls.__name__))
+        return getattr(cls, key).get_bucket(cls._ORM_database_instance)
+
+    @classmethod
+    def _delete_files(cls, files):
+        for key, file_id in files:
+            try:
+                cls.get_file_bucket(key).delete(file_id)
+            except NoFile:
+                logging.warning('GridFS file not found: %s' % file_id)
+
     @classmethod
     def upsert(cls, orm_object, query):
         cls._check_instance(orm_object)
+        # The default of the shard key is in the query, the full shard key is
+        # required to route the write, and it is inserted from the query.
+        query = cls._add_shard_key(orm_object, query, with_default=True)
+        cls.check_shard_query(query, full_key=True)
         set_data, default_data = orm_object._get_upsert_data()
-        cls.get_collection().update_one(
+        for key in cls._ORM_shard_key:
+            # Shard key can not be changed, and is inserted from the query.
+            set_data.pop(key, None)
+            if key in query:
+                default_data.pop(key, None)
+        cls._update_one(
             query, {
                 "$set": set_data,
                 "$setOnInsert": default_data
             },
+            set_data,
             upsert=True)
 
     @classmethod
     def update(cls, orm_object, query):
         cls._check_instance(orm_object)
+        query = cls._add_shard_key(orm_object, query)
+        cls.check_shard_query(query, full_key=True)
         set_data, _ = orm_object._get_upsert_data()
-        cls.get_collection().update_one(query, {"$set": set_data})
+        for key in cls._ORM_shard_key:
+            set_data.pop(key, None)
+        cls._update_one(query, {"$set": set_data}, set_data)
 
     @classmethod
-    def _create_from_pymongo_result(cls, result):
+    def _update_one(cls, query, update, set_data, upsert=False):
+        file_fields = [
+            attr for attr in cls._get_file_field_names() if attr in set_data
+        ]
+        if not file_fields:
+            cls.get_collection().update_one(query, update, upsert=upsert)
+            return
+        # Get the files to replace in the same operation, then delete them.
+        old_data = cls.get_collection().find_one_and_update(
+            query, update, projection=file_fields, upsert=upsert)
+        if old_data:
+            cls._delete_files(
+                [(attr, old_data[attr]) for attr in file_fields
+                 if old_data.get(attr, None) and
+                 old_data[attr] != set_data[attr]])
+
+    @classmethod
+    def _create_from_pymongo_result(cls, result, projection=None):
         if not result:
             return None
 
@@ -133,39 +327,58 @@ class Collection():
             data[attr] = result.get(attr, None)
         orm_object = cls(**data)
         orm_object._sync_server_data()
+        if projection is not None:
+            # The value on server is unknown, not None.
+            orm_object._unloaded_shard_key = [
+                key for key in cls._ORM_shard_key if key not in result
+            ]
         return orm_object
 
     @classmethod
     def find_one(cls, *args, **kargs):
-        return cls._create_from_pymongo_result(cls.get_collection().find_one(
-            *args, **kargs))
+        cls.check_shard_query(cls._get_query_arg(args, kargs))
+        return cls._create_from_pymongo_result(
+            cls.get_collection().find_one(*args, **kargs),
+            cls._get_projection_arg(args, kargs))
 
     @classmethod
     def _get_cursor(cls, *args, **kargs):
+        cls.check_shard_query(cls._get_query_arg(args, kargs))
         cursor = cls.get_collection().find(*args, **kargs)
         return cursor
 
     @classmethod
     def find_many(cls, *args, **kargs):
+        projection = cls._get_projection_arg(args, kargs)
         for result in cls._get_cursor(*args, **kargs):
-            yield cls._create_from_pymongo_result(result)
+            yield cls._create_from_pymongo_result(result, projection)
 
     @classmethod
     def count(cls, *args, **kargs):
         return cls._get_cursor(*args, **kargs).count()
 
     @classmethod
-    def from_id(cls, object_id):
+    def from_id(cls, object_id, **shard_key):
+        """ Find by _id, pass the values of `_ORM_shard_key` as keyword
+        arguments to route the query to a single shard.
+        """
+        for key in shard_key:
+            if key not in cls._ORM_shard_key:
+                raise KeyError('%s is not in the shard key of %s.' %
+                               (key, cls.__name__))
         if not isinstance(object_id, ObjectId):
             if not ObjectId.is_valid(object_id):
                 return None
             object_id = ObjectId(object_id)
-        return cls.find_one({'_id': object_id})
+        query = {'_id': object_id}
+        query.update(shard_key)
+        return cls.find_one(query)
 
     def __init__(self, *args, **kargs):
         self._local_data = None
         self._default_field = None
         self._server_data = {}
+        self._unloaded_shard_key = []
         self._init_local_data(kargs)
 
     def _init_local_data(self, kargs):
@@ -207,6 +420,14 @@ class Collection():
         set_data.pop('_id', None)
         return set_data, default_data
 
+    def _get_replaced_files(self):
+        replaced = []
+        for attr in self._get_file_field_names():
+            file_id = self._server_data.get(attr, None)
+            if file_id and file_id != self._local_data[attr]:
+                replaced.append((attr, file_id))
+        return replaced
+
     def __getitem__(self, key):
         return self._local_data[key]
 
@@ -215,29 +436,74 @@ class Collection():
             raise KeyError('%s is not an attribute of %s.' %
                            (key, self.__class__.__name__))
 
+        if (key in self._ORM_shard_key and key in self._server_data and
+                val != self._server_data[key]):
+            raise RuntimeError('Shard key %s of %s can not be changed.' %
+                               (key, self.__class__.__name__))
+
         self._local_data[key] = val
         if key in self._default_field:
             self._default_field.remove(key)
 
+    def _get_shard_value(self, key):
+        # Use the value on server, in case the local one is not saved yet.
+        if key in self._server_data:
+            return self._server_data[key]
+        return self._local_data[key]
+
+    def _get_document_query(self):
+        query = {'_id': self._local_data['_id']}
+        for key in self._ORM_shard_key:
+            # A document found with a projection may miss the shard key, the
+            # query is on _id only and is broadcast.
+            if key not in self._unloaded_shard_key:
+                query[key] = self._get_shard_value(key)
+        self.check_shard_query(query, full_key=True)
+        return query
+
     def _check_id(self):
         if not self._local_data.get('_id', None):
             raise RuntimeError('Missing _id field.')
 
+    def put_file(self, key, source, filename, content_type=None):
+        """ Upload `source` (bytes or a file-like object) to GridFS.
+
+        The previous file of the field is deleted on the next `save()`.
+        """
+        metadata = {'contentType': content_type} if content_type else None
+        file_id = self.get_file_bucket(key).upload_from_stream(
+            filename, source, metadata=metadata)
+        self[key] = file_id
+        return file_id
+
+    def open_file(self, key):
+        """ Return a seekable GridOut of the field, or None if no file.
+        """
+        file_id = self._local_data[key]
+        if not file_id:
+            return None
+        return self.get_file_bucket(key).open_download_stream(file_id)
+
     def save(self):
         update_data = self._get_update_data()
         if not update_data:
             return
+        replaced_files = self._get_replaced_files()
         if self._local_data.get('_id', None):
-            self.get_collection().update_one({
-                '_id': self._local_data['_id'],
-            }, {'$set': update_data})
+            self.get_collection().update_one(self._get_document_query(),
+                                             {'$set': update_data})
         else:
             insert_res = self.get_collection().insert_one(update_data)
             self._local_data['_id'] = insert_res.inserted_id
         self._sync_server_data()
+        self._delete_files(replaced_files)
 
     def delete(self):
         self._check_id()
-        self.get_collection().delete_one({'_id': self._local_data['_id']})
+        self.get_collection().delete_one(self._get_document_query())
+        self._delete_files(
+            [(attr, self._server_data.get(attr, None))
+             for attr in self._get_file_field_names()
+             if self._server_data.get(attr, None)])
         self._local_data['_id'] = None
         self._server_data = {}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+""" Tornado static file handler backed by a build manifest
+Example:
+
+static_path = os.path.join(os.path.dirname(__file__), '../public')
+ManifestStaticFileHandler.load_manifest(static_path)
+
+app = Application(
+    static_path=static_path,
+    static_handler_class=ManifestStaticFileHandler)
+
+The manifest is a json object which map the logical name of an asset to its
+fingerprinted name, both relative to `static_path`:
+
+{"bundle/index.js": "bundle/index.3f2a1c9d.js"}
+
+`static_url('bundle/index.js')` then resolves to the fingerprinted file, which
+is served with an immutable cache header. An entry which maps a name to
+itself (as written by a development build) is ignored. If `<file>.br` or
+`<file>.gz` exists next to a manifest entry it is served instead when the
+client accepts that encoding.
+"""
+
+from tornado.web import StaticFileHandler
+
+import json
+import logging
+import os
+
+DEFAULT_MANIFEST_NAME = 'bundle/manifest.json'
+
+# Preferred order when the client accepts more than one encoding.
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def parse_accept_encoding(header):
+    """ Return the set of encodings accepted by an Accept-Encoding header.
+    """
+    encodings = set()
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, val = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(val)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(name)
+    return encodings
+
+
+class ManifestStaticFileHandler(StaticFileHandler):
+    # Logical name -> fingerprinted name, both relative to static_path.
+    _manifest = {}
+    _fingerprinted_paths = set()
+    # Absolute path -> version hash, computed once in load_manifest.
+    _content_hashes = {}
+    # Absolute path -> {encoding: absolute path of the precompressed file}.
+    _precompressed = {}
+
+    @classmethod
+    def load_manifest(cls, static_path, manifest_name=DEFAULT_MANIFEST_NAME):
+        manifest_path = os.path.join(static_path, manifest_name)
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError) as e:
+            logging.warning('Static: Could not load manifest %s: %s' %
+                            (manifest_path, e))
+            manifest = {}
+
+        content_hashes = {}
+        precompressed = {}
+        # A development build maps every name to itself. Such a file can change
+        # at any time, so leave it to the versioning of StaticFileHandler.
+        manifest = {
+            name: path
+            for name, path in manifest.items() if name != path
+        }
+        for path in manifest.values():
+            abs_path = cls.get_absolute_path(static_path, path)
+            if not os.path.isfile(abs_path):
+                logging.warning('Static: Missing file in manifest: %s' % path)
+                continue
+            content_hashes[abs_path] = cls.get_content_version(abs_path)
+            variants = {}
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if os.path.isfile(abs_path + suffix):
+                    variants[encoding] = abs_path + suffix
+                    content_hashes[abs_path + suffix] = (
+                        cls.get_content_version(abs_path + suffix))
+            if variants:
+                precompressed[abs_path] = variants
+
+        cls._manifest = manifest
+        cls._fingerprinted_paths = set(manifest.values())
+        cls._content_hashes = content_hashes
+        cls._precompressed = precompressed
+        logging.info('Static: Load %d assets from %s' % (len(manifest),
+                                                           manifest_path))
+
+    @classmethod
+    def make_static_url(cls, settings, path, include_version=True):
+        if path in cls._manifest:
+            # The name is already fingerprinted, no need of `?v=`.
+            return (settings.get('static_url_prefix', '/static/') +
+                    cls._manifest[path])
+        return super().make_static_url(settings, path, include_version)
+
+    @classmethod
+    def _get_cached_version(cls, abs_path):
+        if abs_path in cls._content_hashes:
+            return cls._content_hashes[abs_path]
+        return super()._get_cached_version(abs_path)
+
+    def _is_fingerprinted(self):
+        return self.path.replace(os.path.sep, '/') in self._fingerprinted_paths
+
+    def validate_absolute_path(self, root, absolute_path):
+        self._content_encoding = None
+        self._original_path = None
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        variants = self._precompressed.get(absolute_path)
+        if not absolute_path or not variants:
+            return absolute_path
+
+        accepted = parse_accept_encoding(
+            self.request.headers.get('Accept-Encoding', ''))
+        for encoding, _ in PRECOMPRESSED_ENCODINGS:
+            if encoding in accepted and encoding in variants:
+                try:
+                    self._stat_result = os.stat(variants[encoding])
+                except OSError:
+                    continue
+                self._content_encoding = encoding
+                self._original_path = absolute_path
+                return variants[encoding]
+        return absolute_path
+
+    def get_content_type(self):
+        if self._original_path:
+            # Use the type of the uncompressed file, not `application/gzip`.
+            abs_path = self.absolute_path
+            self.absolute_path = self._original_path
+            try:
+                return super().get_content_type()
+            finally:
+                self.absolute_path = abs_path
+        return super().get_content_type()
+
+    def get_cache_time(self, path, modified, mime_type):
+        if self._is_fingerprinted():
+            return self.CACHE_MAX_AGE
+        return super().get_cache_time(path, modified, mime_type)
+
+    def set_extra_headers(self, path):
+        if self._precompressed.get(self._original_path or self.absolute_path):
+            self.add_header('Vary', 'Accept-Encoding')
+        if self._content_encoding:
+            self.set_header('Content-Encoding', self._content_encoding)
+        if self._is_fingerprinted() or 'v' in self.request.arguments:
+            self.set_header('Cache-Control', 'public, max-age=%d, immutable' %
+                            self.CACHE_MAX_AGE)
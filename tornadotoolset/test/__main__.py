@@ -19,6 +19,10 @@ os.environ['DB_NAME'] = os.getenv('TEST_DB_NAME', 'UnitTestDB')
 
 TEST_MODULES = [
     'tornadotoolset.test.pymonorm_test',
+    'tornadotoolset.test.pymonorm_shard_test',
+    'tornadotoolset.test.filehandler_test',
+    'tornadotoolset.test.loadtest_test',
+    'tornadotoolset.test.static_test',
 ]
 
 
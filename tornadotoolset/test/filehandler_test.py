@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+# Test the GridFS handler mixins
+
+from tornado import gen
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler, stream_request_body
+
+import datetime
+import io
+import time
+import unittest
+import uuid
+
+from tornadotoolset.filehandler import (GridFSDownloadMixin,
+                                        GridFSUploadMixin,
+                                        MultipartStreamParser,
+                                        get_multipart_boundary)
+from tornadotoolset.pymonorm import Collection, Field, FileField
+
+FILE_CONTENT = bytes(range(256)) * 40
+
+
+class TestDocument(Collection):
+    _ORM_collection_name = 'TestDocument'
+
+    name = Field()
+    content = FileField(bucket_name='TestContent', chunk_size=1024)
+
+
+class BufferWriter(io.BytesIO):
+
+    def close(self):
+        self.result = self.getvalue()
+        super().close()
+
+
+def encode_multipart(data, files):
+    boundary = uuid.uuid4().hex
+    body = b''
+    for name, val in data.items():
+        body += ('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n'
+                 '%s\r\n' % (boundary, name, val)).encode()
+    for name, (filename, content, *content_type) in files.items():
+        body += ('--%s\r\nContent-Disposition: form-data; name="%s"; '
+                 'filename="%s"\r\n' % (boundary, name, filename)).encode()
+        if content_type:
+            body += ('Content-Type: %s\r\n' % content_type[0]).encode()
+        body += b'\r\n' + content + b'\r\n'
+    body += ('--%s--\r\n' % boundary).encode()
+    return 'multipart/form-data; boundary=%s' % boundary, body
+
+
+class MultipartStreamParserTest(unittest.TestCase):
+
+    def parse(self, content_type, body, chunk_size):
+        files = []
+        fields = []
+
+        def open_file(name, filename, content_type):
+            writer = BufferWriter()
+            files.append((name, filename, content_type, writer))
+            return writer
+
+        parser = MultipartStreamParser(
+            get_multipart_boundary(content_type), open_file,
+            lambda name, val: fields.append((name, val)), 1024)
+        for i in range(0, len(body), chunk_size):
+            parser.feed(body[i:i + chunk_size])
+        self.assertTrue(parser.is_finished())
+        return files, fields
+
+    def test_boundary(self):
+        self.assertEqual(
+            get_multipart_boundary('multipart/form-data; boundary="a b"'),
+            b'a b')
+        self.assertIsNone(get_multipart_boundary('multipart/form-data'))
+
+    def test_parse(self):
+        content_type, body = encode_multipart({
+            'name': 'Bob',
+            'age': '18'
+        }, {
+            'a': ('a.bin', FILE_CONTENT, 'application/x-test'),
+            'b': ('b.txt', b''),
+        })
+        # Split the body at every possible position of the delimiter.
+        for chunk_size in [1, 2, 3, 7, 64, 1000, len(body)]:
+            files, fields = self.parse(content_type, body, chunk_size)
+            self.assertCountEqual(fields, [('name', b'Bob'), ('age', b'18')])
+            self.assertEqual([f[:3] for f in files],
+                             [('a', 'a.bin', 'application/x-test'),
+                              ('b', 'b.txt', 'application/octet-stream')])
+            self.assertEqual(files[0][3].result, FILE_CONTENT)
+            self.assertEqual(files[1][3].result, b'')
+
+    def test_invalid_header(self):
+        content_type = 'multipart/form-data; boundary=x'
+        body = (b'--x\r\nContent-Disposition: form-data; name="a"\r\n'
+                b'badheaderline\r\n\r\nfoo\r\n--x--\r\n')
+        with self.assertRaises(ValueError):
+            self.parse(content_type, body, len(body))
+
+    def test_field_too_large(self):
+        content_type, body = encode_multipart({'name': 'x' * 2048},
+                                              {'a': ('a', b'a')})
+        with self.assertRaises(ValueError):
+            self.parse(content_type, body, 100)
+
+
+@stream_request_body
+class DocumentHandler(GridFSUploadMixin, GridFSDownloadMixin, RequestHandler):
+    UPLOAD_BUCKET = (TestDocument, 'content')
+    RAW_UPLOAD_FIELD_NAME = 'content'
+
+    async def get(self, name):
+        document = TestDocument.find_one({'name': name})
+        await self.send_grid_file(document.open_file('content'))
+
+    async def post(self, name):
+        uploads = await self.finish_upload()
+        document = TestDocument(name=self.get_argument('name', name))
+        document['content'] = uploads['content'][0].file_id
+        document.save()
+        self.write({'length': uploads['content'][0].length})
+
+
+class FakeGridIn(io.BytesIO):
+
+    def __init__(self, filename, metadata):
+        super().__init__()
+        self.filename = filename
+        self.metadata = metadata
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+        self.close()
+
+
+class FakeBucket():
+
+    def __init__(self):
+        self.files = []
+
+    def open_upload_stream(self, filename, metadata=None):
+        # A slow database, the client leaves meanwhile.
+        time.sleep(0.05)
+        grid_in = FakeGridIn(filename, metadata)
+        self.files.append(grid_in)
+        return grid_in
+
+
+class FakeGridOut(io.BytesIO):
+    _id = 'abc'
+    metadata = {'contentType': 'application/octet-stream'}
+    filename = 'a.bin'
+    upload_date = datetime.datetime(2020, 1, 1)
+    chunk_size = 1024
+    length = len(FILE_CONTENT)
+
+
+@stream_request_body
+class FakeUploadHandler(GridFSUploadMixin, RequestHandler):
+
+    def prepare(self):
+        super().prepare()
+        self.settings['upload_handlers'].append(self)
+
+    def get_upload_bucket(self, name):
+        return self.settings['bucket']
+
+    async def post(self):
+        await self.finish_upload()
+
+
+class FakeDownloadHandler(GridFSDownloadMixin, RequestHandler):
+
+    async def get(self):
+        grid_out = FakeGridOut(FILE_CONTENT)
+        self.settings['grid_outs'].append(grid_out)
+        await self.send_grid_file(grid_out)
+
+
+class FakeGridFSHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self._bucket = FakeBucket()
+        self._grid_outs = []
+        self._upload_handlers = []
+        return Application(
+            [(r'/upload', FakeUploadHandler),
+             (r'/download', FakeDownloadHandler)],
+            bucket=self._bucket,
+            grid_outs=self._grid_outs,
+            upload_handlers=self._upload_handlers)
+
+    @gen_test
+    async def test_abort_upload(self):
+        stream = await TCPClient().connect('127.0.0.1', self.get_http_port())
+        body = (b'--x\r\nContent-Disposition: form-data; name="a"; '
+                b'filename="a"\r\n\r\naaa\r\n--x\r\nContent-Disposition: '
+                b'form-data; name="b"; filename="b"\r\n\r\nbbb')
+        await stream.write(
+            b'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+            b'Content-Type: multipart/form-data; boundary=x\r\n'
+            b'Content-Length: 100000\r\n\r\n' + body)
+        while not self._bucket.files:
+            await gen.sleep(0.01)
+        # The connection is lost while a file part is opened in the executor.
+        # Tornado only detects it after the chunk, call it now instead.
+        self._upload_handlers[0].on_connection_close()
+        for _ in range(100):
+            if (len(self._bucket.files) == 2 and
+                    all(grid_in.aborted for grid_in in self._bucket.files)):
+                break
+            await gen.sleep(0.01)
+        stream.close()
+        # The second part is not opened if the abort is seen first.
+        self.assertTrue(self._bucket.files)
+        for grid_in in self._bucket.files:
+            self.assertTrue(grid_in.aborted)
+
+    def test_close_grid_out(self):
+        res = self.fetch('/download')
+        self.assertEqual(res.body, FILE_CONTENT)
+        res = self.fetch('/download', headers={'Range': 'bytes=100000-'})
+        self.assertEqual(res.code, 416)
+        self.assertEqual(len(self._grid_outs), 2)
+        for grid_out in self._grid_outs:
+            self.assertTrue(grid_out.closed)
+
+
+class GridFSHandlerTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._db = TestDocument._ORM_database_instance
+        for name in [
+                'TestDocument', 'TestContent.files', 'TestContent.chunks'
+        ]:
+            self._db.drop_collection(name)
+
+    def get_app(self):
+        return Application([(r'/document/(\w+)', DocumentHandler)])
+
+    def test_multipart_upload(self):
+        content_type, body = encode_multipart({
+            'name': 'Alice'
+        }, {'content': ('a.bin', FILE_CONTENT, 'application/x-test')})
+        res = self.fetch(
+            '/document/bob',
+            method='POST',
+            headers={'Content-Type': content_type},
+            body=body)
+        self.assertEqual(res.code, 200)
+        document = TestDocument.find_one({'name': 'Alice'})
+        grid_out = document.open_file('content')
+        self.assertEqual(grid_out.read(), FILE_CONTENT)
+        self.assertEqual(grid_out.metadata['contentType'],
+                         'application/x-test')
+
+    def test_raw_upload(self):
+        res = self.fetch(
+            '/document/bob?filename=bob.bin',
+            method='POST',
+            headers={'Content-Type': 'application/x-test'},
+            body=FILE_CONTENT)
+        self.assertEqual(res.code, 200)
+        grid_out = TestDocument.find_one({'name': 'bob'}).open_file('content')
+        self.assertEqual(grid_out.filename, 'bob.bin')
+        self.assertEqual(grid_out.read(), FILE_CONTENT)
+
+    def test_invalid_upload(self):
+        content_type, body = encode_multipart({}, {'content': ('a', b'a')})
+        res = self.fetch(
+            '/document/bob',
+            method='POST',
+            headers={'Content-Type': content_type},
+            body=body[:-10])
+        self.assertEqual(res.code, 400)
+        # The incomplete file is removed.
+        self.assertEqual(self._db['TestContent.files'].count_documents({}), 0)
+
+    def test_invalid_header(self):
+        content_type = 'multipart/form-data; boundary=x'
+        body = (b'--x\r\nContent-Disposition: form-data; name="content"; '
+                b'filename="a"\r\nbadheaderline\r\n\r\nfoo\r\n--x--\r\n')
+        res = self.fetch(
+            '/document/bob',
+            method='POST',
+            headers={'Content-Type': content_type},
+            body=body)
+        self.assertEqual(res.code, 400)
+
+    def test_download(self):
+        document = TestDocument(name='bob')
+        document.put_file('content', FILE_CONTENT, 'bob.bin', 'image/png')
+        document.save()
+
+        res = self.fetch('/document/bob')
+        self.assertEqual(res.code, 200)
+        self.assertEqual(res.body, FILE_CONTENT)
+        self.assertEqual(res.headers['Content-Type'], 'image/png')
+
+        res = self.fetch(
+            '/document/bob', headers={'If-None-Match': res.headers['Etag']})
+        self.assertEqual(res.code, 304)
+
+        res = self.fetch('/document/bob', headers={'Range': 'bytes=1000-2999'})
+        self.assertEqual(res.code, 206)
+        self.assertEqual(res.body, FILE_CONTENT[1000:3000])
+        self.assertEqual(res.headers['Content-Range'],
+                         'bytes 1000-2999/%d' % len(FILE_CONTENT))
+
+        res = self.fetch('/document/bob', headers={'Range': 'bytes=-10'})
+        self.assertEqual(res.body, FILE_CONTENT[-10:])
+
+        res = self.fetch(
+            '/document/bob',
+            headers={'Range': 'bytes=%d-' % len(FILE_CONTENT)})
+        self.assertEqual(res.code, 416)
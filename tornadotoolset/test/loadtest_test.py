@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# Test the load generator
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tornadotoolset.loadtest import (LoadGenerator, build_request,
+                                     percentile)
+
+
+class EchoHandler(RequestHandler):
+
+    def get(self):
+        self.write(self.get_argument('name', ''))
+
+    def post(self):
+        self.write(self.request.body)
+
+
+def make_app():
+    return Application([(r'/echo', EchoHandler)])
+
+
+class LoadTestTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return make_app()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_build_request(self):
+        req = build_request('http://localhost', {
+            'method': 'post',
+            'path': '/echo',
+            'params': {
+                'a': 1
+            },
+            'json': {
+                'name': 'Bob'
+            },
+        }, 5)
+        self.assertEqual(req.method, 'POST')
+        self.assertEqual(req.url, 'http://localhost/echo?a=1')
+        self.assertEqual(json.loads(req.body), {'name': 'Bob'})
+        self.assertEqual(req.headers['Content-Type'], 'application/json')
+
+        req = build_request('http://localhost', {
+            'method': 'POST',
+            'path': '/echo',
+            'data': {
+                'name': 'Bob'
+            },
+        }, 5)
+        self.assertEqual(req.body, b'name=Bob')
+
+    @gen_test
+    async def test_run(self):
+        entries = [
+            {
+                'path': '/echo',
+                'params': {
+                    'name': 'Bob'
+                }
+            },
+            {
+                'method': 'POST',
+                'path': '/echo',
+                'data': {
+                    'name': 'Bob'
+                }
+            },
+            {
+                'name': 'missing',
+                'path': '/missing'
+            },
+        ]
+        generator = LoadGenerator(
+            self.get_url(''), entries, concurrency=4, duration=0, total=30)
+        report = await generator.run()
+        self.assertEqual(report['requests'], 30)
+        self.assertEqual(report['errors'], 10)
+        self.assertEqual(report['status'], {'200': 20, '404': 10})
+        self.assertEqual(report['routes']['missing']['error_rate'], 1)
+        self.assertEqual(report['routes']['GET /echo']['requests'], 10)
+        self.assertLessEqual(report['latency_ms']['p50'],
+                             report['latency_ms']['max'])
+
+    @gen_test
+    async def test_run_with_rate(self):
+        generator = LoadGenerator(
+            self.get_url(''), [{
+                'path': '/echo'
+            }],
+            concurrency=2,
+            rate=200,
+            duration=0,
+            total=20)
+        report = await generator.run()
+        self.assertEqual(report['requests'], 20)
+        self.assertEqual(report['errors'], 0)
+        # 20 requests at 200/s take at least 95ms.
+        self.assertGreaterEqual(report['duration'], 0.09)
+
+
+class LoadTestMainTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._scenario = os.path.join(self._dir, 'scenario.json')
+        with open(self._scenario, 'w') as f:
+            json.dump({
+                'requests': [{
+                    'path': '/echo'
+                }, {
+                    'path': '/missing'
+                }]
+            }, f)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def run_main(self, *args):
+        # Run in a new process, the servers must be forked before any IOLoop
+        # is created. The app must only be imported by the servers.
+        output = subprocess.check_output(
+            [
+                sys.executable, '-c',
+                'import sys\n'
+                'from tornadotoolset.loadtest import main\n'
+                'main("tornadotoolset.test.loadtest_test.make_app")\n'
+                'assert "tornadotoolset.test.loadtest_test" not in sys.modules',
+                self._scenario, '-d', '0', '-n', '20'
+            ] + list(args),
+            timeout=60)
+        return json.loads(output.decode())
+
+    def test_main(self):
+        report = self.run_main('-p', '2', '-c', '4')
+        self.assertEqual(report['requests'], 20)
+        self.assertEqual(report['status'], {'200': 10, '404': 10})
+        self.assertEqual(report['config']['processes'], 2)
+        self.assertEqual(report['config']['keep_alive'],
+                         report['config']['client'] == 'curl')
+
+    def test_main_unix_socket(self):
+        socket_path = os.path.join(self._dir, 'test.sock')
+        report = self.run_main('--unix-socket', socket_path)
+        self.assertEqual(report['requests'], 20)
+        self.assertEqual(report['errors'], 10)
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertEqual(report['config']['client'], 'simple')
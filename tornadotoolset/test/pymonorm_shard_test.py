@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Test the ORM module of pymongo on a sharded cluster.
+# Start one with |tool/start-shard-cluster| and set TEST_SHARD_DB_HOST to the
+# address of mongos.
+
+from pymongo import MongoClient
+
+import os
+import unittest
+
+from tornadotoolset.pymonorm import Collection, Field, DB_TIMEOUT
+
+SHARD_DB_HOST = os.getenv('TEST_SHARD_DB_HOST', '')
+SHARD_DB_NAME = os.getenv('TEST_DB_NAME', 'UnitTestDB')
+
+
+class TestShardItem(Collection):
+    _ORM_database_instance = MongoClient(
+        host=SHARD_DB_HOST or 'localhost',
+        serverSelectionTimeoutMS=DB_TIMEOUT,
+        connect=False)[SHARD_DB_NAME]
+    _ORM_collection_name = 'TestShardItem'
+    _ORM_shard_key = ['owner']
+
+    owner = Field()
+    name = Field()
+
+
+@unittest.skipUnless(SHARD_DB_HOST, 'TEST_SHARD_DB_HOST is not set.')
+class ShardCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        database = TestShardItem._ORM_database_instance
+        database.drop_collection(TestShardItem._ORM_collection_name)
+        TestShardItem.shard_collection()
+        shards = database.client.admin.command('listShards')['shards']
+        self.assertGreaterEqual(len(shards), 2)
+
+        # Put the owners 'a' and 'b' on different shards.
+        full_name = TestShardItem.get_collection().full_name
+        database.client.admin.command('split', full_name, middle={'owner': 'b'})
+        database.client.admin.command(
+            'moveChunk',
+            full_name,
+            find={'owner': 'b'},
+            to=shards[1]['_id'],
+            _secondaryThrottle=True)
+        database.client.admin.command(
+            'moveChunk',
+            full_name,
+            find={'owner': 'a'},
+            to=shards[0]['_id'],
+            _secondaryThrottle=True)
+
+    def test_targeted_query(self):
+        self.assertEqual(
+            len(TestShardItem.get_query_shards({
+                'owner': 'a',
+                'name': 'x'
+            })), 1)
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(TestShardItem.check_shard_query({'name': 'x'}))
+        self.assertEqual(len(TestShardItem.get_query_shards({'name': 'x'})), 2)
+
+    def test_save_and_delete(self):
+        item = TestShardItem(owner='b', name='foo')
+        item.save()
+        self.assertEqual(
+            len(TestShardItem.get_query_shards(item._get_document_query())),
+            1)
+
+        item = TestShardItem.from_id(item['_id'], owner='b')
+        self.assertEqual(item['name'], 'foo')
+        item['name'] = 'bar'
+        item.save()
+        self.assertEqual(
+            TestShardItem.find_one({
+                'owner': 'b',
+                'name': 'bar'
+            })['_id'], item['_id'])
+
+        with self.assertRaises(RuntimeError):
+            item['owner'] = 'a'
+        item.delete()
+        self.assertIsNone(TestShardItem.from_id(item['_id'], owner='b'))
+
+    def test_update(self):
+        TestShardItem(owner='a', name='foo').save()
+        TestShardItem.update(
+            TestShardItem(owner='a', name='bar'), {'name': 'foo'})
+        self.assertIsNotNone(
+            TestShardItem.find_one({
+                'owner': 'a',
+                'name': 'bar'
+            }))
+
+        TestShardItem.upsert(
+            TestShardItem(owner='b', name='baz'), {'name': 'baz'})
+        self.assertIsNotNone(
+            TestShardItem.find_one({
+                'owner': 'b',
+                'name': 'baz'
+            }))
+
+        # The owner holds its default, the upsert is routed with a null key.
+        TestShardItem.upsert(TestShardItem(name='qux'), {'name': 'qux'})
+        self.assertIsNotNone(
+            TestShardItem.find_one({
+                'owner': None,
+                'name': 'qux'
+            }))
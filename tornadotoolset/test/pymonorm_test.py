@@ -2,13 +2,17 @@
 
 # Test the ORM module of pymongo
 
+from bson.objectid import ObjectId
 from datetime import datetime
+from unittest import mock
 
 import pymongo
 import time
 import unittest
 
-from tornadotoolset.pymonorm import Collection, Field, get_database_from_env
+from tornadotoolset import pymonorm
+from tornadotoolset.pymonorm import (Collection, Field, FileField,
+                                     get_database_from_env)
 
 
 def get_date_time():
@@ -37,6 +41,22 @@ class TestInherit(TestUser, TestFoo):
     _ORM_collection_name = 'TestInherit'
 
 
+class TestShardUser(Collection):
+    _ORM_collection_name = 'TestShardUser'
+    _ORM_shard_key = ['region', 'uid']
+
+    region = Field()
+    uid = Field(time.time)
+    name = Field()
+
+
+class TestFile(Collection):
+    _ORM_collection_name = 'TestFile'
+
+    name = Field()
+    avatar = FileField(bucket_name='TestAvatar', chunk_size=4)
+
+
 class MongoOrmTest(unittest.TestCase):
 
     def setUp(self):
@@ -201,3 +221,213 @@ class MongoOrmTest(unittest.TestCase):
                 'birthday': bob['birthday'],
                 'created': bob['created'],
             })
+
+
+class FileFieldTest(unittest.TestCase):
+
+    def setUp(self):
+        self._db = get_database_from_env()
+        for name in ['TestFile', 'TestAvatar.files', 'TestAvatar.chunks']:
+            self._db.drop_collection(name)
+        self._files = self._db['TestAvatar.files']
+
+    def test_file_bucket(self):
+        self.assertEqual(TestFile._get_file_field_names(), ['avatar'])
+        with self.assertRaises(KeyError):
+            TestFile.get_file_bucket('name')
+
+    def test_put_file(self):
+        bob = TestFile(name='Bob')
+        self.assertIsNone(bob.open_file('avatar'))
+        file_id = bob.put_file('avatar', b'0123456789', 'bob.png', 'image/png')
+        bob.save()
+
+        bob = TestFile.find_one({'name': 'Bob'})
+        self.assertEqual(bob['avatar'], file_id)
+        grid_out = bob.open_file('avatar')
+        self.assertEqual(grid_out.filename, 'bob.png')
+        self.assertEqual(grid_out.metadata['contentType'], 'image/png')
+        grid_out.seek(6)
+        self.assertEqual(grid_out.read(), b'6789')
+
+    def test_replace_file(self):
+        bob = TestFile(name='Bob')
+        old_id = bob.put_file('avatar', b'old', 'old.png')
+        bob.save()
+        new_id = bob.put_file('avatar', b'new', 'new.png')
+        # The old file is kept until the document is saved.
+        self.assertEqual(self._files.count_documents({}), 2)
+        bob.save()
+        self.assertIsNone(self._files.find_one({'_id': old_id}))
+        self.assertIsNotNone(self._files.find_one({'_id': new_id}))
+
+    def test_update_replace_file(self):
+        bob = TestFile(name='Bob')
+        old_id = bob.put_file('avatar', b'old', 'old.png')
+        bob.save()
+
+        alice = TestFile(name='Alice')
+        new_id = alice.put_file('avatar', b'new', 'new.png')
+        TestFile.update(alice, {'name': 'Bob'})
+        self.assertIsNone(self._files.find_one({'_id': old_id}))
+        self.assertEqual(TestFile.find_one({'name': 'Alice'})['avatar'], new_id)
+
+        carol = TestFile(name='Carol')
+        carol.put_file('avatar', b'carol', 'carol.png')
+        TestFile.upsert(carol, {'name': 'Alice'})
+        self.assertIsNone(self._files.find_one({'_id': new_id}))
+        self.assertEqual(self._files.count_documents({}), 1)
+
+    def test_delete(self):
+        bob = TestFile(name='Bob')
+        bob.put_file('avatar', b'avatar', 'bob.png')
+        bob.save()
+        bob.delete()
+        self.assertEqual(self._files.count_documents({}), 0)
+
+
+class ShardKeyTest(unittest.TestCase):
+
+    def get_saved_user(self):
+        # Same as a document returned by find_one.
+        user = TestShardUser(_id=ObjectId(), region='tw', uid=1, name='Bob')
+        user._sync_server_data()
+        return user
+
+    def test_check_shard_query(self):
+        self.assertTrue(TestUser.check_shard_query({'name': 'Bob'}))
+        self.assertTrue(
+            TestShardUser.check_shard_query({
+                'region': 'tw',
+                'uid': 1,
+                'name': 'Bob'
+            }))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(TestShardUser.check_shard_query({'uid': 1}))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(TestShardUser.check_shard_query(None))
+        with mock.patch.object(pymonorm, 'DB_SHARD_QUERY_CHECK', 'raise'):
+            with self.assertRaises(RuntimeError):
+                TestShardUser.check_shard_query({'name': 'Bob'})
+
+    def test_check_shard_query_condition(self):
+        # A prefix of the shard key is enough.
+        self.assertTrue(TestShardUser.check_shard_query({'region': 'tw'}))
+        self.assertTrue(
+            TestShardUser.check_shard_query({
+                'region': {
+                    '$in': ['tw', 'jp']
+                },
+                'uid': {
+                    '$gt': 1
+                }
+            }))
+        self.assertTrue(
+            TestShardUser.check_shard_query({'region': {
+                '$eq': 'tw'
+            }}))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(
+                TestShardUser.check_shard_query({'region': {
+                    '$exists': True
+                }}))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(
+                TestShardUser.check_shard_query({
+                    'region': {
+                        '$ne': 'tw'
+                    },
+                    'uid': 1
+                }))
+        # find_one(object_id)
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(TestShardUser.check_shard_query(ObjectId()))
+
+    def test_from_id_shard_key(self):
+        with self.assertRaises(KeyError):
+            TestShardUser.from_id(ObjectId(), region='tw', name='Bob')
+
+    def test_document_query(self):
+        user = self.get_saved_user()
+        self.assertEqual(user._get_document_query(), {
+            '_id': user['_id'],
+            'region': 'tw',
+            'uid': 1
+        })
+
+        # A null shard key is routable.
+        user = TestShardUser(_id=ObjectId(), region='tw', uid=None)
+        user._sync_server_data()
+        self.assertEqual(user._get_document_query(), {
+            '_id': user['_id'],
+            'region': 'tw',
+            'uid': None
+        })
+
+        # Found with a projection without the shard key.
+        user = TestShardUser._create_from_pymongo_result(
+            {
+                '_id': ObjectId(),
+                'region': 'tw'
+            }, {'region': 1})
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(user._get_document_query(), {
+                '_id': user['_id'],
+                'region': 'tw'
+            })
+
+    def test_check_shard_query_full_key(self):
+        query = {'region': 'tw', 'uid': None}
+        self.assertTrue(TestShardUser.check_shard_query(query, full_key=True))
+        with self.assertLogs(level='WARNING'):
+            query = {'region': 'tw'}
+            self.assertFalse(
+                TestShardUser.check_shard_query(query, full_key=True))
+        with self.assertLogs(level='WARNING'):
+            query = {'region': 'tw', 'uid': {'$in': [1, 2]}}
+            self.assertFalse(
+                TestShardUser.check_shard_query(query, full_key=True))
+
+    def test_upsert_shard_key(self):
+        collection = mock.Mock()
+        with mock.patch.object(TestShardUser, 'get_collection',
+                               return_value=collection), \
+                mock.patch.object(pymonorm, 'DB_SHARD_QUERY_CHECK', 'raise'):
+            # uid still holds its default, it is part of the query.
+            user = TestShardUser(region='tw', name='Bob')
+            TestShardUser.upsert(user, {'name': 'Bob'})
+            query, update = collection.update_one.call_args[0]
+            self.assertEqual(query, {
+                'name': 'Bob',
+                'region': 'tw',
+                'uid': user['uid']
+            })
+            self.assertNotIn('uid', update['$setOnInsert'])
+
+            with self.assertRaises(RuntimeError):
+                TestShardUser.update(
+                    TestShardUser(region='tw', name='Bob'), {'name': 'Bob'})
+
+    def test_protect_shard_key(self):
+        user = TestShardUser(region='tw')
+        user['region'] = 'jp'  # Not saved yet
+
+        user = self.get_saved_user()
+        user['region'] = 'tw'
+        user['name'] = 'Alice'
+        with self.assertRaises(RuntimeError):
+            user['region'] = 'jp'
+        self.assertEqual(user['region'], 'tw')
+
+    def test_add_shard_key(self):
+        self.assertEqual(
+            TestShardUser._add_shard_key(
+                TestShardUser(region='tw'), {'name': 'Bob'}), {
+                    'name': 'Bob',
+                    'region': 'tw'
+                })
+        self.assertEqual(
+            TestShardUser._add_shard_key(self.get_saved_user(), {'uid': 2}), {
+                'region': 'tw',
+                'uid': 2
+            })
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Test the manifest static file handler
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from tornadotoolset.static import (ManifestStaticFileHandler,
+                                   parse_accept_encoding)
+
+BUNDLE_CONTENT = b'console.log("hello");\n' * 100
+MANIFEST_STATE = [
+    '_manifest', '_fingerprinted_paths', '_content_hashes', '_precompressed'
+]
+
+
+class ManifestStaticFileHandlerTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        # load_manifest sets class attributes, restore them after the test.
+        self._class_state = {
+            name: getattr(ManifestStaticFileHandler, name)
+            for name in MANIFEST_STATE
+        }
+        self._static_path = tempfile.mkdtemp()
+        bundle_path = os.path.join(self._static_path, 'bundle')
+        os.mkdir(bundle_path)
+        self.write_file('bundle/index.1234abcd.js', BUNDLE_CONTENT)
+        self.write_file('bundle/index.1234abcd.js.gz',
+                        gzip.compress(BUNDLE_CONTENT))
+        self.write_file('bundle/index.1234abcd.js.br', b'fake brotli')
+        self.write_file('robots.txt', b'User-agent: *\n')
+        self.write_file(
+            'bundle/manifest.json',
+            json.dumps({
+                'bundle/index.js': 'bundle/index.1234abcd.js'
+            }).encode())
+        ManifestStaticFileHandler.load_manifest(self._static_path)
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self._static_path)
+        for name, val in self._class_state.items():
+            setattr(ManifestStaticFileHandler, name, val)
+        ManifestStaticFileHandler.reset()
+
+    def write_file(self, path, content):
+        with open(os.path.join(self._static_path, path), 'wb') as f:
+            f.write(content)
+
+    def get_app(self):
+        return Application(
+            static_path=self._static_path,
+            static_handler_class=ManifestStaticFileHandler)
+
+    def get_static_url(self, path):
+        return ManifestStaticFileHandler.make_static_url(
+            self._app.settings, path)
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(
+            parse_accept_encoding('gzip, deflate, br'),
+            {'gzip', 'deflate', 'br'})
+        self.assertEqual(
+            parse_accept_encoding('gzip;q=1.0, br;q=0, identity'),
+            {'gzip', 'identity'})
+        self.assertEqual(parse_accept_encoding(''), set())
+
+    def test_static_url(self):
+        self.assertEqual(
+            self.get_static_url('bundle/index.js'),
+            '/static/bundle/index.1234abcd.js')
+        self.assertTrue(
+            self.get_static_url('robots.txt').startswith(
+                '/static/robots.txt?v='))
+
+    def test_fingerprinted(self):
+        res = self.fetch(
+            self.get_static_url('bundle/index.js'),
+            headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(res.code, 200)
+        self.assertEqual(res.body, BUNDLE_CONTENT)
+        self.assertIn('immutable', res.headers['Cache-Control'])
+        self.assertEqual(res.headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_precompressed(self):
+        url = self.get_static_url('bundle/index.js')
+        res = self.fetch(
+            url, headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('javascript', res.headers['Content-Type'])
+        self.assertEqual(gzip.decompress(res.body), BUNDLE_CONTENT)
+        gzip_etag = res.headers['Etag']
+
+        res = self.fetch(
+            url,
+            headers={'Accept-Encoding': 'gzip, br'},
+            decompress_response=False)
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertEqual(res.body, b'fake brotli')
+        self.assertNotEqual(res.headers['Etag'], gzip_etag)
+
+        res = self.fetch(
+            url,
+            headers={
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': gzip_etag
+            },
+            decompress_response=False)
+        self.assertEqual(res.code, 304)
+
+    def test_not_fingerprinted(self):
+        res = self.fetch('/static/robots.txt')
+        self.assertEqual(res.code, 200)
+        self.assertNotIn('Cache-Control', res.headers)
+        self.assertNotIn('Vary', res.headers)
+
+    def test_identity_manifest(self):
+        self.write_file(
+            'bundle/manifest.json',
+            json.dumps({
+                'bundle/index.1234abcd.js': 'bundle/index.1234abcd.js'
+            }).encode())
+        ManifestStaticFileHandler.load_manifest(self._static_path)
+        url = self.get_static_url('bundle/index.1234abcd.js')
+        self.assertTrue(url.startswith('/static/bundle/index.1234abcd.js?v='))
+
+        res = self.fetch('/static/bundle/index.1234abcd.js')
+        self.assertNotIn('Cache-Control', res.headers)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+        # The file may be rebuilt, the Etag must follow its content.
+        ManifestStaticFileHandler.reset()
+        self.write_file('bundle/index.1234abcd.js', b'rebuilt')
+        res = self.fetch(
+            '/static/bundle/index.1234abcd.js',
+            headers={'If-None-Match': res.headers['Etag']})
+        self.assertEqual(res.code, 200)
+        self.assertEqual(res.body, b'rebuilt')
+
+    def test_missing_manifest(self):
+        os.remove(os.path.join(self._static_path, 'bundle/manifest.json'))
+        ManifestStaticFileHandler.load_manifest(self._static_path)
+        res = self.fetch(
+            '/static/bundle/index.1234abcd.js',
+            headers={'Accept-Encoding': 'gzip'},
+            decompress_response=False)
+        self.assertEqual(res.body, BUNDLE_CONTENT)
+        self.assertNotIn('Content-Encoding', res.headers)